@@ -12,67 +12,223 @@ you choose to save outputs.
 """
 
 import argparse
+import io
 import json
+import marshal
 import os
+import re
 import subprocess
 import sys
 import tempfile
 import shutil
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+def json_loads(content):
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+def json_dumpb(data, pretty=True):
+    # UTF-8 bytes, ready to be written to a binary file; compact unless pretty.
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(data, option=option)
+    # ensure_ascii=False: raw UTF-8 like orjson, so the output doesn't depend on which is installed.
+    if pretty:
+        return json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
 
 def load_file(path):
-    if not os.path.exists(path):
-        sys.exit(f"Error: File '{path}' not found.")
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return f.read().strip()
+        # Bytes go straight to the parser (orjson or json), with no separate decode step and no
+        # strip() copy: both parsers skip surrounding whitespace themselves.
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        sys.exit(f"Error: File '{path}' not found.")
     except Exception as e:
         sys.exit(f"Error reading '{path}': {e}")
 
-def parse_json_dump(path):
-    content = load_file(path)
-    valid = []
+def iter_json_lines(lines):
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            obj = json_loads(line)
+        except ValueError:
+            continue
+        if isinstance(obj, dict) and "rowCount" not in obj:
+            yield obj
+
+def iter_change_objects(path):
     try:
-        data = json.loads(content)
-        if isinstance(data, list):
-            valid = [d for d in data if isinstance(d, dict) and "rowCount" not in d]
-        elif isinstance(data, dict):
-            valid = [data]
-    except json.JSONDecodeError:
-        for line in content.splitlines():
+        with open(path, "rb") as f:
+            first = f.readline()
+            while first and not first.strip():
+                first = f.readline()
             try:
-                obj = json.loads(line.strip())
-                if isinstance(obj, dict) and "rowCount" not in obj:
-                    valid.append(obj)
-            except json.JSONDecodeError:
-                continue
-    if not valid:
+                obj = json_loads(first)
+            except ValueError:
+                obj = None
+            if isinstance(obj, dict):
+                # One object per line (gerrit query output): stream the rest of the file.
+                if "rowCount" not in obj:
+                    yield obj
+                yield from iter_json_lines(f)
+                return
+            start = first.lstrip()[:1]
+            if ijson is not None and start in (b"[", b"{"):
+                # Top-level array, or pretty-printed object(s): have ijson build one change at a
+                # time straight from the file instead of holding the raw text next to the result.
+                f.seek(0)
+                found = False
+                prefix = "item" if start == b"[" else ""
+                try:
+                    for d in ijson.items(f, prefix, multiple_values=True, use_float=True):
+                        if isinstance(d, dict) and "rowCount" not in d:
+                            found = True
+                            yield d
+                    return
+                except ijson.JSONError:
+                    if found:
+                        return
+                # Not a well-formed array; fall through to the line-by-line fallback below.
+                f.seek(0)
+                content = f.read()
+            else:
+                content = first + f.read()
+    except FileNotFoundError:
+        sys.exit(f"Error: File '{path}' not found.")
+    except OSError as e:
+        sys.exit(f"Error reading '{path}': {e}")
+    try:
+        data = json_loads(content)
+    except ValueError:
+        yield from iter_json_lines(content.splitlines())
+        return
+    if isinstance(data, list):
+        for d in data:
+            if isinstance(d, dict) and "rowCount" not in d:
+                yield d
+    elif isinstance(data, dict):
+        yield data
+
+def parse_json_dump(path, scan_all=False):
+    objs = iter_change_objects(path)
+    first = next(objs, None)
+    if first is None:
         sys.exit("Error: No valid change object found in JSON dump.")
-    if len(valid) > 1:
+    if scan_all and next(objs, None) is not None:
         print("Warning: Multiple change objects found; using the first one.")
-    return valid[0]
+    objs.close()
+    return first
+
+def load_cached(path, loader, *args):
+    # Parsed data is kept in <path>.<loader>.cache (marshal: fast, and only plain JSON types go
+    # in) together with the source's size and mtime_ns, and reused only while both still match
+    # exactly. Any unreadable cache is just rebuilt. Like pickle, marshal is not safe on untrusted
+    # data, so the cache is only for inputs in directories the user controls.
+    # The loader is part of the name since the dump and comments loaders read the same file differently.
+    cache = f"{path}.{loader.__name__}.cache"
+    try:
+        st = os.stat(path)
+    except OSError:
+        return loader(path, *args)
+    stamp = (st.st_size, st.st_mtime_ns)
+    try:
+        with open(cache, "rb") as f:
+            cached = marshal.load(f)
+        if isinstance(cached, tuple) and len(cached) == 2 and cached[0] == stamp:
+            return cached[1]
+    except (OSError, ValueError, EOFError, TypeError):
+        pass
+    data = loader(path, *args)
+    try:
+        with open(cache + ".tmp", "wb") as f:
+            marshal.dump((stamp, data), f)
+        os.replace(cache + ".tmp", cache)
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not write cache '{cache}': {e}")
+    return data
 
 def load_comments_json(path):
     content = load_file(path)
     try:
-        return json.loads(content)
+        return json_loads(content)
     except Exception as e:
         sys.exit(f"Error parsing JSON from '{path}': {e}")
 
+# id(dict) -> (dict, {lowered key: original key}); the dict itself is kept so a reused id is detected.
+_key_index = {}
+
 def get_key(data, key, default=None):
     if key in data:
         return data[key]
     lk = key.lower()
-    for k, v in data.items():
-        if k.lower() == lk:
-            return v
-    return default
+    entry = _key_index.get(id(data))
+    # Rebuild when the id was recycled or the indexed key has since been renamed (normalize_keys).
+    if entry is None or entry[0] is not data or (lk in entry[1] and entry[1][lk] not in data):
+        entry = (data, {k.lower(): k for k in reversed(data)})
+        _key_index[id(data)] = entry
+    k = entry[1].get(lk)
+    return data[k] if k is not None else default
 
-def get_patchsets(data):
-    ps = get_key(data, "patchSets") or get_key(data, "patch_sets", [])
+# Canonical casing for the keys this script reads; applied once after loading.
+CANONICAL_KEYS = {k.lower(): k for k in (
+    "patchSets", "comments", "number", "revision",
+    "file", "line", "patchSet", "reviewer", "message", "timestamp",
+)}
+
+def normalize_keys(d):
+    for k in list(d):
+        canon = CANONICAL_KEYS.get(k.lower()) if isinstance(k, str) else None
+        if canon and canon != k and canon not in d:
+            d[canon] = d.pop(k)
+
+# Account objects attached to patch sets and comments; their strings repeat across the dump.
+ACCOUNT_KEYS = ("reviewer", "uploader", "author", "owner")
+
+def intern_accounts(d):
+    for key in ACCOUNT_KEYS:
+        account = d.get(key)
+        if isinstance(account, dict):
+            for k, v in account.items():
+                if isinstance(v, str):
+                    account[k] = sys.intern(v)
+
+def normalize_change(data):
+    if not isinstance(data, dict):
+        return data
+    normalize_keys(data)
+    for obj in get_patchsets(data) + get_comments(data):
+        if isinstance(obj, dict):
+            normalize_keys(obj)
+            intern_accounts(obj)
+    return data
+
+def find_patchsets(data):
+    # Exact keys first; get_key's case-insensitive lookup only when both miss.
+    ps = data.get("patchSets") or data.get("patch_sets")
+    if ps is None:
+        ps = get_key(data, "patchSets") or get_key(data, "patch_sets")
     return ps if isinstance(ps, list) else []
 
-def get_comments(data):
-    cm = get_key(data, "comments")
+def find_comments(data):
+    cm = data.get("comments")
+    if cm is None:
+        cm = get_key(data, "comments")
     if isinstance(cm, list):
         return cm
     elif isinstance(cm, dict):
@@ -83,16 +239,41 @@ def get_comments(data):
         return out
     return []
 
+# id(change) -> (change, patchsets, comments); looked up (and flattened) once per change.
+_lists = {}
+
+def change_lists(data):
+    entry = _lists.get(id(data))
+    if entry is None or entry[0] is not data:
+        entry = (data, find_patchsets(data), find_comments(data))
+        _lists[id(data)] = entry
+    return entry
+
+def get_patchsets(data):
+    return change_lists(data)[1]
+
+def get_comments(data):
+    return change_lists(data)[2]
+
+# id(change) -> (change, {str(number): patchset}); built once per change like _key_index.
+_ps_index = {}
+
+def patchset_index(data):
+    entry = _ps_index.get(id(data))
+    if entry is None or entry[0] is not data:
+        # reversed() so the first patchset wins if a number repeats, as with a linear scan.
+        entry = (data, {str(ps.get("number")): ps for ps in reversed(get_patchsets(data))})
+        _ps_index[id(data)] = entry
+    return entry[1]
+
 def get_patchset_revision(data, ps_num):
-    for ps in get_patchsets(data):
-        if str(ps.get("number")) == str(ps_num):
-            return ps.get("revision")
-    return None
+    ps = patchset_index(data).get(str(ps_num))
+    return ps.get("revision") if ps else None
 
-def save_comments(data, path):
+def save_comments(data, path, pretty=False):
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
+        with open(path, "wb") as f:
+            f.write(json_dumpb(data, pretty))
         print(f"Comments saved to '{path}'.")
     except Exception as e:
         sys.exit(f"Error saving comments to '{path}': {e}")
@@ -102,199 +283,387 @@ def prompt_patchset(data, chosen):
     if not ps_list:
         sys.exit("Error: No patchsets found in the JSON.")
     if chosen:
-        for ps in ps_list:
-            if str(ps.get("number")) == str(chosen):
-                return str(ps.get("number"))
+        if str(chosen) in patchset_index(data):
+            return str(chosen)
         sys.exit(f"Error: Patchset {chosen} not found.")
     print("Available patchsets:")
     for ps in ps_list:
         rev = str(ps.get("revision")) if ps.get("revision") else "N/A"
         print(f"  {ps.get('number')} (revision: {rev[:7] if rev != 'N/A' else rev})")
+    if not sys.stdin.isatty():
+        sys.exit("Error: No patchset given; pass --patchset when running non-interactively.")
     sel = input("Select patchset number to virtualize: ").strip()
     if not sel:
         sys.exit("No patchset selected.")
     return sel
 
-def group_comments_by_file(comments, ps_filter=None):
+def group_comments_by_file(comments, ps_filter=None, file_match=None):
+    psf = str(ps_filter) if ps_filter else None
+    # Dumps carry patchset numbers as ints; compare those without a str() per comment.
+    psf_int = int(psf) if psf and psf.isdigit() and str(int(psf)) == psf else None
     grouped = {}
+    # file_match result per path, so the filter runs once per file rather than per comment.
+    keep = {}
     for c in comments:
         ps = c.get("patchSet") or c.get("patch_set")
-        if ps_filter and ps and str(ps) != str(ps_filter):
+        if psf and ps and (ps != psf_int if type(ps) is int else str(ps) != psf):
             continue
         fname = c.get("file")
         if not fname:
             continue
+        if file_match:
+            ok = keep.get(fname)
+            if ok is None:
+                ok = keep[fname] = bool(file_match(fname))
+            if not ok:
+                continue
         grouped.setdefault(fname, []).append(c)
     return grouped
 
+def compile_file_filter(patterns):
+    # Substring filters folded into one regex so each path is matched in a single pass.
+    patterns = [p for p in patterns or [] if p]
+    if not patterns:
+        return None
+    return re.compile("|".join(map(re.escape, patterns))).search
+
+def existing_files(paths, root=None):
+    # One scandir per parent directory instead of a stat per path.
+    # Basenames map back to the original paths, which are returned as given (Gerrit uses "/").
+    parents = {}
+    for p in paths:
+        parents.setdefault(os.path.dirname(p), {})[os.path.basename(p)] = p
+    found = set()
+    for parent, names in parents.items():
+        d = os.path.join(root, parent) if root else (parent or ".")
+        try:
+            with os.scandir(d) as it:
+                for entry in it:
+                    p = names.get(entry.name)
+                    if p is not None and entry.is_file():
+                        found.add(p)
+        except OSError:
+            continue
+    return found
+
 def clone_working_directory(rev):
-    cwd = os.getcwd()
+    # A detached worktree shares the repository's objects, so nothing but the checkout is written.
     temp_dir = tempfile.mkdtemp(prefix="gerrit_clone_")
     clone_path = os.path.join(temp_dir, "clone")
     try:
-        shutil.copytree(cwd, clone_path, symlinks=True, dirs_exist_ok=True)
-        subprocess.check_call(["git", "-C", clone_path, "checkout", rev])
+        subprocess.check_call(["git", "worktree", "add", "--quiet", "--detach", clone_path, rev])
         return clone_path, temp_dir
     except Exception as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
         sys.exit(f"Error cloning working directory and checking out revision {rev}: {e}")
 
-def annotate_content(content, comments, indent, syntax, fields, order):
-    lines = content.splitlines()
+def get_files_from_git(rev, paths):
+    # One `git cat-file --batch` for all paths instead of a git process per file. Each request
+    # gets either "<sha> <type> <size>" followed by the object and a newline, or a
+    # "<name> missing" line, so an absent path only affects its own entry.
+    paths = list(paths)
+    files = dict.fromkeys(paths)
+    request = "".join(f"{rev}:{p}\n" for p in paths).encode("utf-8")
+    try:
+        proc = subprocess.Popen(["git", "cat-file", "--batch"], stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        out, _ = proc.communicate(request)
+    except OSError:
+        return files
+    pos = 0
+    for p in paths:
+        nl = out.find(b"\n", pos)
+        if nl < 0:
+            break
+        header = out[pos:nl].split()
+        pos = nl + 1
+        if len(header) != 3 or not header[2].isdigit():
+            continue
+        size = int(header[2])
+        if header[1] == b"blob":
+            files[p] = out[pos:pos + size]
+        pos += size + 1
+    return files
+
+def remove_clone(clone_dir):
+    subprocess.call(["git", "worktree", "remove", "--force", clone_dir])
+    shutil.rmtree(os.path.dirname(clone_dir), ignore_errors=True)
+
+_EMPTY = {}
+
+FIELD_GETTERS = {
+    "patchset": lambda c: f"Patchset {c.get('patchSet') or c.get('patch_set','')}",
+    "reviewer": lambda c: c.get("reviewer", _EMPTY).get("name", "Unknown"),
+    "message": lambda c: c.get("message", ""),
+    "timestamp": lambda c: str(c.get("timestamp", "")),
+}
+
+def build_annotations(comments, indent, syntax, fields, order):
+    # Returns {line number: encoded annotation block}, built once per file before any source is read.
     ann_map = {}
-    def build_ann(c):
-        parts = []
-        for field in fields:
-            if field.lower() == "patchset":
-                parts.append(f"Patchset {c.get('patchSet') or c.get('patch_set','')}")
-            elif field.lower() == "reviewer":
-                reviewer = c.get("reviewer", {})
-                parts.append(reviewer.get("name", "Unknown"))
-            elif field.lower() == "message":
-                parts.append(c.get("message", ""))
-            elif field.lower() == "timestamp":
-                parts.append(str(c.get("timestamp", "")))
-            else:
-                parts.append(str(c.get(field, "")))
-        return f"{syntax} " + ", ".join(parts)
-    sorted_comments = sorted(comments, key=lambda c: int(c.get("patchSet") or 0))
+    # Field extractors are resolved once per call rather than re-matched for every comment.
+    getters = [FIELD_GETTERS.get(field.lower()) or (lambda c, k=field: str(c.get(k, ""))) for field in fields]
+    prefix = f"{indent}{syntax} "
+    # Flatten each comment once into (patchset, line, encoded annotation line) before sorting.
+    flat = [
+        (int(c.get("patchSet") or 0), ln, (prefix + ", ".join([g(c) for g in getters]) + "\n").encode("utf-8"))
+        for c in comments
+        if (ln := c.get("line")) is not None
+    ]
+    # Gerrit usually lists comments in patchset order already; only sort when it didn't.
+    if any(a[0] > b[0] for a, b in zip(flat, flat[1:])):
+        flat.sort(key=lambda r: r[0])
     if order == "latest":
-        sorted_comments = list(reversed(sorted_comments))
-    for c in sorted_comments:
-        ln = c.get("line")
-        if ln is None:
-            continue
-        ann = build_ann(c)
+        flat.reverse()
+    for _, ln, ann in flat:
         ann_map.setdefault(ln, []).append(ann)
-    new_lines = []
-    for i, line in enumerate(lines, start=1):
-        new_lines.append(line)
-        if i in ann_map:
-            for a in ann_map[i]:
-                new_lines.append(indent + a)
-    return "\n".join(new_lines) + "\n"
-
-def diff_in_vscode(annotated, current, diff_tool):
-    annotated = os.path.abspath(annotated)
-    current = os.path.abspath(current)
+    # Each line's annotations are joined once, so writing does one lookup and one write per line.
+    return {ln: b"".join(anns) for ln, anns in ann_map.items()}
+
+def write_annotated(src, out, blocks):
+    # Streams binary lines from src to out, adding each line's annotation block after it, so a
+    # large file is never held whole. Line endings are copied as they are, and each block (built
+    # with "\n") takes the ending of the line it follows, so CRLF files stay CRLF. Annotated lines are
+    # visited in order, so each source line costs one int compare, and everything after the
+    # last annotated line is copied in one piece. Returns how many blocks were written
+    # (0: no comment landed on a line of this file).
+    w = out.write
+    readline = src.readline
+    written = 0
+    i = 0
+    eol = b"\n"
+    # Integral floats ("line": 2.0) count as their int, as the dict lookup they replace did.
+    for n, ln in sorted((int(ln), ln) for ln in blocks if isinstance(ln, (int, float)) and ln > 0 and ln % 1 == 0):
+        while i < n:
+            line = readline()
+            if not line:
+                return written
+            i += 1
+            w(line)
+            if not line.endswith(b"\n"):
+                w(eol)
+        if line.endswith(b"\n"):
+            eol = b"\r\n" if line.endswith(b"\r\n") else b"\n"
+        block = blocks[ln]
+        w(block if eol == b"\n" else block.replace(b"\n", eol))
+        written += 1
+    rest = src.read()
+    if rest:
+        w(rest)
+        if not rest.endswith(b"\n"):
+            w(eol)
+    return written
+
+def diff_in_vscode(annotated, current, diff_tool, reuse_window=False):
+    # Launches without waiting and returns the process handle (None on failure).
+    # Both paths must already be absolute (process_files resolves them).
+    cmd = [diff_tool, "--reuse-window"] if reuse_window else [diff_tool]
     try:
-        subprocess.run([diff_tool, "--diff", annotated, current])
+        return subprocess.Popen(
+            cmd + ["--diff", annotated, current],
+            # stdin detached so a launcher can't swallow the "Press Enter" reply; stderr kept so a
+            # misconfigured --diff-tool still reports its error.
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+            # With a resolved tool path and close_fds=False, Popen can use posix_spawn instead of
+            # fork+exec; our own fds are non-inheritable (PEP 446), so nothing leaks to the tool.
+            close_fds=False,
+        )
     except Exception as e:
         print(f"Error launching diff for '{current}': {e}")
 
-def process_files(data, ps_filter, file_filter, mode, diff_tool, indent, syntax, fields, order, temp_dir, clone_dir):
-    rev = get_patchset_revision(data, ps_filter) if mode in ["git", "clone"] else None
-    grouped = group_comments_by_file(get_comments(data), ps_filter)
-    if file_filter:
-        grouped = {f: cs for f, cs in grouped.items() if file_filter in f}
+def process_files(grouped, rev, mode, diff_tool, indent, syntax, fields, order, temp_dir, clone_dir, reuse_window=False):
     if not grouped:
         print("No inline comments found for the selected patchset or file filter.")
         return
-    for f, comms in grouped.items():
+    local_files = existing_files(grouped)
+    clone_files = existing_files(grouped, clone_dir) if mode == "clone" else set()
+    git_files = get_files_from_git(rev, grouped) if mode == "git" else {}
+    basenames = Counter(os.path.basename(f) for f in grouped)
+
+    # Returns (annotated_file, None) or (None, message); messages are printed in file order.
+    def prepare(job):
+        index, (f, comms) = job
+        # Built before the source is opened, so a bad comment can't leak the handle.
+        blocks = build_annotations(comms, indent, syntax, fields, order)
         if mode == "git":
-            content = get_file_from_git(rev, f)
+            content = git_files.get(f)
             if content is None:
-                print(f"Skipping file '{f}' (unable to retrieve from git).")
-                continue
+                return None, f"Skipping file '{f}' (unable to retrieve from git)."
+            src = io.BytesIO(content)
         elif mode == "clone":
-            file_path = os.path.join(clone_dir, f)
-            if not os.path.exists(file_path):
-                print(f"File '{f}' not found in cloned directory.")
-                continue
+            if f not in clone_files:
+                return None, f"File '{f}' not found in cloned directory."
             try:
-                with open(file_path, "r", encoding="utf-8") as fp:
-                    content = fp.read()
+                src = open(os.path.join(clone_dir, f), "rb")
             except Exception as e:
-                print(f"Error reading cloned file '{f}': {e}")
-                continue
+                return None, f"Error reading cloned file '{f}': {e}"
         else:
-            if not os.path.exists(f):
-                print(f"File '{f}' not found locally.")
-                continue
+            if f not in local_files:
+                return None, f"File '{f}' not found locally."
             try:
-                with open(f, "r", encoding="utf-8") as fp:
-                    content = fp.read()
+                src = open(f, "rb")
             except Exception as e:
-                print(f"Error reading file '{f}': {e}")
-                continue
-        annotated = annotate_content(content, comms, indent, syntax, fields, order)
-        annotated_file = os.path.join(temp_dir, os.path.basename(f) + ".annotated")
-        try:
-            with open(annotated_file, "w", encoding="utf-8") as fp:
-                fp.write(annotated)
-        except Exception as e:
-            print(f"Error writing annotated file for '{f}': {e}")
+                return None, f"Error reading file '{f}': {e}"
+        base = os.path.basename(f)
+        name = f"{index}_{base}" if basenames[base] > 1 else base
+        annotated_file = os.path.join(temp_dir, name + ".annotated")
+        with src:
+            try:
+                with open(annotated_file, "wb") as out:
+                    written = write_annotated(src, out, blocks)
+            except Exception as e:
+                return None, f"Error writing annotated file for '{f}': {e}"
+        if not written:
+            # No comment landed on a line of this file; a diff would show nothing.
+            os.remove(annotated_file)
+            return None, f"No annotations for '{f}'; skipping diff."
+        return annotated_file, None
+
+    # Reading and annotating is independent per file; diffs are then launched in file order.
+    # temp_dir comes from mkdtemp and is absolute; local paths are resolved against one getcwd().
+    cwd = os.getcwd()
+    diff_tool = shutil.which(diff_tool) or diff_tool
+    with ThreadPoolExecutor(max_workers=min(8, len(grouped))) as ex:
+        results = list(ex.map(prepare, enumerate(grouped.items())))
+    procs = []
+    for f, (annotated_file, message) in zip(grouped, results):
+        if annotated_file is None:
+            print(message)
             continue
-        if os.path.exists(f):
-            diff_in_vscode(annotated_file, f, diff_tool)
+        if f in local_files:
+            proc = diff_in_vscode(annotated_file, os.path.join(cwd, f), diff_tool, reuse_window)
+            if proc is not None:
+                procs.append(proc)
         else:
             print(f"Original file '{f}' not found for diffing.")
+    for proc in procs:
+        proc.wait()
+
+def make_preserved_dir(dest):
+    # Created up front (dest, dest_1, ...) and written into directly: the diff tool is given
+    # these paths, so the files must not move afterwards.
+    base, n = dest, 1
+    while True:
+        try:
+            os.mkdir(dest)
+            return dest
+        except FileExistsError:
+            dest = f"{base}_{n}"
+            n += 1
+
+def write_summaries(data, formats, summary_file=None):
+    # Each summary is built only when it is printed and streamed straight into the summary
+    # file, so at most one large rendering (the JSON dump) is alive at a time. The file is
+    # binary so the JSON bytes from the serializer are written without re-encoding.
+    out = None
+    if summary_file:
+        try:
+            out = open(summary_file, "wb")
+        except Exception as e:
+            print(f"Error writing summary file: {e}")
+    overview = None
+    for fmt in dict.fromkeys(formats):
+        if fmt == "json":
+            raw = json_dumpb(data)
+            summ = raw.decode("utf-8")
+        else:
+            if overview is None:
+                numbers = ", ".join(str(ps.get("number")) for ps in get_patchsets(data)) or "none"
+                overview = f"Patchsets: {numbers}\nTotal comments: {len(get_comments(data))}"
+            summ = overview
+            raw = summ.encode("utf-8")
+        # Non-ASCII text must not crash the summary on a terminal that can't encode it.
+        enc = sys.stdout.encoding or "utf-8"
+        print(f"\n--- {fmt.upper()} SUMMARY ---\n{summ}\n".encode(enc, "replace").decode(enc))
+        if out:
+            try:
+                out.write(f"--- {fmt.upper()} SUMMARY ---\n".encode("utf-8"))
+                out.write(raw)
+                out.write(b"\n\n")
+            except Exception as e:
+                print(f"Error writing summary file: {e}")
+                out.close()
+                out = None
+        del summ, raw
+    if out:
+        out.close()
+        print(f"Summary saved to '{summary_file}'.")
 
 def main():
     parser = argparse.ArgumentParser(description="Gerrit Diff Wrapper (Virtualize Patchset with Inline Comments)")
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument("--json-file", help="Path to Gerrit JSON dump")
     group.add_argument("--load-comments", help="Path to saved comments file")
+    parser.add_argument("--scan-all", action="store_true", help="Scan the whole JSON dump and warn if it holds more than one change")
     parser.add_argument("--save-comments", help="Save downloaded comments to file")
+    parser.add_argument("--pretty", action="store_true", help="Indent the JSON written by --save-comments (default: compact, whichever input it came from)")
+    parser.add_argument("--cache", action="store_true", help="Cache the parsed input next to it (<file>.<loader>.cache) and reuse it while the input is unchanged; --scan-all reads the dump without it")
     parser.add_argument("--patchset", help="Patchset number to virtualize", type=str)
-    parser.add_argument("--file", help="Filter by file name substring", type=str)
+    parser.add_argument("--file", nargs="+", help="Filter by file name substring (several may be given; a file matching any is kept)", type=str)
     parser.add_argument("--indent", default="    ", help="Indentation for appended comments (default: 4 spaces)")
     parser.add_argument("--comment-syntax", default="//", help="Comment syntax to prefix annotation (default: //)")
     parser.add_argument("--comment-fields", default="patchset,reviewer,message", help="Comma-separated list of fields to show in annotations (default: patchset,reviewer,message)")
     parser.add_argument("--order", choices=["oldest", "latest"], default="oldest", help="Order of comment display (default: oldest first)")
     parser.add_argument("--diff-tool", default="code", help="Diff tool executable (default: code for VS Code)")
+    parser.add_argument("--reuse-window", action="store_true", help="Pass --reuse-window to the diff tool so all diffs open in one VS Code window")
     parser.add_argument("--mode", choices=["clone", "git", "local"], help="Diff mode: clone (clone working dir and checkout patchset), git (retrieve files from git), local (use current files)", required=True)
     parser.add_argument("--summary-file", help="File to save summary output")
-    parser.add_argument("--output-format", choices=["json", "markdown", "text"], nargs="+", default=["json"])
+    parser.add_argument("--output-format", choices=["json", "markdown", "text"], nargs="+", help="Summaries to print (default: none, or json when --summary-file is given)")
     parser.add_argument("--no-cleanup", action="store_true", help="Do not delete temporary directories")
     args = parser.parse_args()
 
     if args.load_comments:
-        data = load_comments_json(args.load_comments)
+        if args.cache:
+            data = load_cached(args.load_comments, load_comments_json)
+        else:
+            data = load_comments_json(args.load_comments)
+    elif args.cache and not args.scan_all:
+        data = load_cached(args.json_file, parse_json_dump)
     else:
-        data = parse_json_dump(args.json_file)
+        data = parse_json_dump(args.json_file, args.scan_all)
+    data = normalize_change(data)
     if args.save_comments:
-        save_comments(data, args.save_comments)
-    summaries = {}
-    for fmt in args.output_format:
-        if fmt == "json":
-            summaries["json"] = json.dumps(data, indent=2)
-        elif fmt == "markdown":
-            summaries["markdown"] = f"Patchsets: {get_patchsets(data)}\nTotal comments: {len(get_comments(data))}"
-        elif fmt == "text":
-            summaries["text"] = f"Patchsets: {get_patchsets(data)}\nTotal comments: {len(get_comments(data))}"
-    for fmt, summ in summaries.items():
-        print(f"\n--- {fmt.upper()} SUMMARY ---\n{summ}\n")
-    if args.summary_file:
-        try:
-            with open(args.summary_file, "w", encoding="utf-8") as f:
-                for fmt, summ in summaries.items():
-                    f.write(f"--- {fmt.upper()} SUMMARY ---\n{summ}\n\n")
-            print(f"Summary saved to '{args.summary_file}'.")
-        except Exception as e:
-            print(f"Error writing summary file: {e}")
+        save_comments(data, args.save_comments, args.pretty)
+    # Summaries (the JSON one re-serializes the whole dump) are only built when asked for.
+    formats = args.output_format or (["json"] if args.summary_file else [])
+    if formats:
+        write_summaries(data, formats, args.summary_file)
     selected_ps = args.patchset if args.patchset else prompt_patchset(data, None)
     fields = [x.strip() for x in args.comment_fields.split(",")]
-    temp_root = tempfile.mkdtemp(prefix="gerrit_diff_")
+    file_match = compile_file_filter(args.file)
+    # Resolved and grouped once here; process_files only consumes the results.
+    rev = get_patchset_revision(data, selected_ps) if args.mode in ("git", "clone") else None
+    grouped = group_comments_by_file(get_comments(data), selected_ps, file_match)
     clone_dir = None
     if args.mode == "clone":
-        rev = get_patchset_revision(data, selected_ps)
         if not rev:
             sys.exit(f"Error: Unable to retrieve revision for patchset {selected_ps}.")
         print(f"Cloning working directory and checking out revision {rev}...")
         clone_dir, clone_temp = clone_working_directory(rev)
+    # Without a terminal there is no prompt to hold the annotated files while the diff tool
+    # (which returns before it has read them) is open, so they are kept as with --no-cleanup.
+    keep = args.no_cleanup or not sys.stdin.isatty()
+    # The clone worktree is registered in the user's repository and only read while the
+    # annotated files are written, so it is removed right after, however that step ends.
     try:
-        process_files(data, selected_ps, args.file, args.mode, args.diff_tool, args.indent, args.comment_syntax, fields, args.order, temp_root, clone_dir)
-    except Exception as e:
-        print(f"Error processing diffs: {e}")
-    if args.no_cleanup:
-        preserved = os.path.join(os.getcwd(), "gerrit_temp_preserved")
-        shutil.copytree(temp_root, preserved)
-        print(f"Temporary files preserved at '{preserved}'.")
+        if keep:
+            temp_root = make_preserved_dir(os.path.join(os.getcwd(), "gerrit_temp_preserved"))
+        else:
+            temp_root = tempfile.mkdtemp(prefix="gerrit_diff_")
+        try:
+            process_files(grouped, rev, args.mode, args.diff_tool, args.indent, args.comment_syntax, fields, args.order, temp_root, clone_dir, args.reuse_window)
+        except Exception as e:
+            print(f"Error processing diffs: {e}")
+    finally:
+        if clone_dir:
+            remove_clone(clone_dir)
+    # An empty temp dir (no diff was opened) is not worth keeping.
+    if args.no_cleanup or (keep and os.listdir(temp_root)):
+        print(f"Temporary files preserved at '{temp_root}'.")
     else:
-        input("Press Enter to clean up temporary files and exit...")
+        if not keep:
+            input("Press Enter to clean up temporary files and exit...")
         shutil.rmtree(temp_root, ignore_errors=True)
-        if args.mode == "clone" and clone_dir:
-            shutil.rmtree(os.path.dirname(clone_dir), ignore_errors=True)
 
 if __name__ == "__main__":
     main()
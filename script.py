@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import argparse
+import io
 import json
 import os
 import re
@@ -7,6 +8,22 @@ import subprocess
 import sys
 import tempfile
 import getpass
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Default for missing account objects.
+_EMPTY = {}
+
+def json_loads(content):
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
 
 # ----------------------------
 # Git Helper Functions
@@ -16,7 +33,7 @@ def run_git_command(cmd):
         out = subprocess.check_output(["git"] + cmd, stderr=subprocess.STDOUT)
         return out.decode("utf-8").strip()
     except subprocess.CalledProcessError as e:
-        print("Git command failed:", e.output.decode())
+        print("Git command failed:", e.output.decode("utf-8", errors="replace"))
         sys.exit(1)
 
 def get_current_commit():
@@ -25,9 +42,11 @@ def get_current_commit():
 def get_commit_message(commit_hash):
     return run_git_command(["log", "-1", "--pretty=%B", commit_hash])
 
+CHANGE_ID_RE = re.compile(r'Change-Id:\s*(I[a-f0-9]+)')
+
 def extract_change_id(commit_message):
     # Look for a Change-Id line and return the value (raw, without prefix text)
-    m = re.search(r'Change-Id:\s*(I[a-f0-9]+)', commit_message)
+    m = CHANGE_ID_RE.search(commit_message)
     if m:
         return m.group(1)
     return None
@@ -52,210 +71,292 @@ def run_ssh_query(gerrit_config, identifier_value):
         "gerrit", "query", "--patch-sets", "--comments", identifier_value, "--format=JSON"
     ]
     try:
-        result = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as e:
-        print("SSH query failed:", e.output.decode())
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError as e:
+        print("SSH query failed:", e)
         sys.exit(1)
 
     # Gerrit outputs one JSON object per line; the final line is stats.
-    change_objs = []
-    for line in result.decode("utf-8").splitlines():
-        line = line.strip()
-        if not line:
-            continue
-        try:
-            obj = json.loads(line)
-            # Skip the stats object (if present)
-            if "rowCount" in obj:
+    # Lines are parsed as bytes while ssh streams them; once the change is found the rest
+    # of the output is only drained. Unparseable lines are kept: they are the error text
+    # if ssh fails, and warnings otherwise.
+    change_info = None
+    bad_lines = []
+    with proc:
+        for line in proc.stdout:
+            if change_info is not None:
+                continue
+            line = line.strip()
+            if not line:
                 continue
-            change_objs.append(obj)
-        except json.JSONDecodeError as e:
-            print("Warning: JSON decode error on line:", line)
-    if not change_objs:
+            try:
+                obj = json_loads(line)
+            except ValueError:
+                bad_lines.append(line.decode("utf-8", errors="replace"))
+                continue
+            # Skip the stats object (if present)
+            if "rowCount" not in obj:
+                change_info = obj
+    if proc.returncode != 0:
+        print("SSH query failed:", "\n".join(bad_lines))
+        sys.exit(1)
+    for line in bad_lines:
+        print("Warning: JSON decode error on line:", line)
+    if change_info is None:
         print("No change information found from Gerrit query.")
         sys.exit(1)
-    return change_objs[0]
+    return change_info
 
 # ----------------------------
 # Output Formatting Functions
 # ----------------------------
+def build_view(change_info):
+    """
+    Collect what the output formatters and diff views need in a single pass over
+    change_info: patch sets sorted by number, change messages, inline comments grouped
+    by file and then by patch set, and the same comments grouped by file and line.
+    Each comment is flattened once into a (line, patchset, reviewer, message) tuple,
+    so the formatters and annotations unpack fields instead of repeating dict lookups.
+    Built once and shared by every format and by display_all_file_diffs.
+    """
+    patchsets = change_info.get("patchSets", [])
+    numbers = [int(ps.get("number", 0)) for ps in patchsets]
+    # Gerrit already lists patch sets in order; only sort (on the pre-coerced numbers) when it didn't.
+    if any(a > b for a, b in zip(numbers, numbers[1:])):
+        patchsets = [ps for _, ps in sorted(zip(numbers, patchsets), key=itemgetter(0))]
+    else:
+        patchsets = list(patchsets)
+    comments = {}
+    lines = {}
+    # Inline comments are a dict keyed by file; `gerrit query --comments` output has a list of
+    # change-level comments here instead, which has nothing to group.
+    by_file = change_info.get("comments", {})
+    for file, comms in (by_file.items() if isinstance(by_file, dict) else ()):
+        by_ps = comments[file] = defaultdict(list)
+        by_line = lines[file] = defaultdict(list)
+        for c in comms:
+            line = c.get("line", "N/A")
+            flat = (
+                line,
+                c.get("patchSet", c.get("patch_set", "Unknown")),
+                c.get("reviewer", _EMPTY).get("name", "Unknown"),
+                c.get("message", ""),
+            )
+            by_ps[flat[1]].append(flat)
+            if c.get("line") is not None:
+                by_line[line].append(flat)
+    return {
+        "change": change_info,
+        "patchSets": patchsets,
+        "messages": change_info.get("messages", []),
+        "comments": comments,
+        "lines": lines,
+    }
+
 def format_output_json(change_info):
     # Save the entire change_info as JSON (it contains patchSets, comments, messages, etc.)
-    return json.dumps(change_info, indent=2)
+    # Returned as UTF-8 bytes, straight from the serializer, so main writes it without re-encoding.
+    if orjson is not None:
+        return orjson.dumps(change_info, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(change_info, indent=2, ensure_ascii=False).encode("utf-8")
 
-def format_output_markdown(change_info):
-    md = []
-    change_number = change_info.get("_number", "Unknown")
-    subject = change_info.get("subject", "No subject")
-    md.append(f"# Gerrit Change {change_number}: {subject}\n")
+def format_output_markdown(view):
+    # Every line after the title is written with a leading newline, so the
+    # output matches joining the lines with "\n".
+    buf = io.StringIO()
+    w = buf.write
+    change_number = view["change"].get("_number", "Unknown")
+    subject = view["change"].get("subject", "No subject")
+    w(f"# Gerrit Change {change_number}: {subject}\n")
     
-    md.append("## Patch Sets\n")
-    patchsets = change_info.get("patchSets", [])
+    w("\n## Patch Sets\n")
+    patchsets = view["patchSets"]
     if patchsets:
-        # Sort patch sets by number
-        patchsets.sort(key=lambda ps: int(ps.get("number", 0)))
         for ps in patchsets:
             rev = ps.get("revision", "N/A")[:7]
-            uploader = ps.get("uploader", {}).get("name", "Unknown")
+            uploader = ps.get("uploader", _EMPTY).get("name", "Unknown")
             created = ps.get("created", "")
-            md.append(f"- **Patchset {ps.get('number')}**: revision `{rev}`, uploader: {uploader}, created: {created}")
+            w(f"\n- **Patchset {ps.get('number')}**: revision `{rev}`, uploader: {uploader}, created: {created}")
     else:
-        md.append("No patch set information found.")
+        w("\nNo patch set information found.")
 
-    md.append("\n## Change Messages\n")
-    messages = change_info.get("messages", [])
+    w("\n\n## Change Messages\n")
+    messages = view["messages"]
     if messages:
         for m in messages:
             ps_num = m.get("_revision_number", "N/A")
-            author = m.get("author", {}).get("name", "Unknown")
+            author = m.get("author", _EMPTY).get("name", "Unknown")
             date = m.get("date", "")
             msg = m.get("message", "")
-            md.append(f"- **Patchset {ps_num}** by {author} on {date}: {msg}")
+            w(f"\n- **Patchset {ps_num}** by {author} on {date}: {msg}")
     else:
-        md.append("No change messages found.")
+        w("\nNo change messages found.")
         
-    md.append("\n## Inline Comments by File\n")
-    comments = change_info.get("comments", {})
+    w("\n\n## Inline Comments by File\n")
+    comments = view["comments"]
     if comments:
-        for file, comms in comments.items():
-            md.append(f"### File: {file}")
-            # Group comments by patch set
-            grouped = {}
-            for c in comms:
-                ps = c.get("patchSet", c.get("patch_set", "Unknown"))
-                grouped.setdefault(ps, []).append(c)
+        for file, grouped in comments.items():
+            w(f"\n### File: {file}")
             for ps, clist in grouped.items():
-                md.append(f"  - **Patchset {ps}**:")
-                for c in clist:
-                    line = c.get("line", "N/A")
-                    reviewer = c.get("reviewer", {}).get("name", "Unknown")
-                    msg = c.get("message", "")
-                    md.append(f"      - Line {line}: {reviewer}: {msg}")
+                w(f"\n  - **Patchset {ps}**:")
+                for line, _, reviewer, msg in clist:
+                    w(f"\n      - Line {line}: {reviewer}: {msg}")
     else:
-        md.append("No inline comments found.")
-    return "\n".join(md)
+        w("\nNo inline comments found.")
+    return buf.getvalue()
 
-def format_output_text(change_info):
-    txt = []
-    change_number = change_info.get("_number", "Unknown")
-    subject = change_info.get("subject", "No subject")
-    txt.append(f"Gerrit Change {change_number}: {subject}\n")
+def format_output_text(view):
+    # Same leading-newline convention as format_output_markdown.
+    buf = io.StringIO()
+    w = buf.write
+    change_number = view["change"].get("_number", "Unknown")
+    subject = view["change"].get("subject", "No subject")
+    w(f"Gerrit Change {change_number}: {subject}\n")
     
-    txt.append("Patch Sets:")
-    patchsets = change_info.get("patchSets", [])
+    w("\nPatch Sets:")
+    patchsets = view["patchSets"]
     if patchsets:
-        patchsets.sort(key=lambda ps: int(ps.get("number", 0)))
         for ps in patchsets:
             rev = ps.get("revision", "N/A")[:7]
-            uploader = ps.get("uploader", {}).get("name", "Unknown")
+            uploader = ps.get("uploader", _EMPTY).get("name", "Unknown")
             created = ps.get("created", "")
-            txt.append(f"  Patchset {ps.get('number')}: revision {rev}, uploader: {uploader}, created: {created}")
+            w(f"\n  Patchset {ps.get('number')}: revision {rev}, uploader: {uploader}, created: {created}")
     else:
-        txt.append("  None")
+        w("\n  None")
         
-    txt.append("\nChange Messages:")
-    messages = change_info.get("messages", [])
+    w("\n\nChange Messages:")
+    messages = view["messages"]
     if messages:
         for m in messages:
             ps_num = m.get("_revision_number", "N/A")
-            author = m.get("author", {}).get("name", "Unknown")
+            author = m.get("author", _EMPTY).get("name", "Unknown")
             date = m.get("date", "")
             msg = m.get("message", "")
-            txt.append(f"  Patchset {ps_num} by {author} on {date}: {msg}")
+            w(f"\n  Patchset {ps_num} by {author} on {date}: {msg}")
     else:
-        txt.append("  None")
+        w("\n  None")
         
-    txt.append("\nInline Comments by File:")
-    comments = change_info.get("comments", {})
+    w("\n\nInline Comments by File:")
+    comments = view["comments"]
     if comments:
-        for file, comms in comments.items():
-            txt.append(f"File: {file}")
-            grouped = {}
-            for c in comms:
-                ps = c.get("patchSet", c.get("patch_set", "Unknown"))
-                grouped.setdefault(ps, []).append(c)
+        for file, grouped in comments.items():
+            w(f"\nFile: {file}")
             for ps, clist in grouped.items():
-                txt.append(f"  Patchset {ps}:")
-                for c in clist:
-                    line = c.get("line", "N/A")
-                    reviewer = c.get("reviewer", {}).get("name", "Unknown")
-                    msg = c.get("message", "")
-                    txt.append(f"    Line {line}: {reviewer}: {msg}")
+                w(f"\n  Patchset {ps}:")
+                for line, _, reviewer, msg in clist:
+                    w(f"\n    Line {line}: {reviewer}: {msg}")
     else:
-        txt.append("  None")
-    return "\n".join(txt)
+        w("\n  None")
+    return buf.getvalue()
 
 # ----------------------------
 # VS Code Diff Functions
 # ----------------------------
-def annotate_file_with_all_comments(filepath, comments):
+def annotate_file_with_all_comments(src, out, comments_by_line):
     """
-    Read the original file and create an annotated version that includes inline comment markers.
-    Comments are grouped by line number and show the patch set number and reviewer.
+    Copy the original file (binary file object src) to out, adding inline comment markers.
+    comments_by_line maps line numbers to flattened comments (see build_view); annotations show
+    the patch set number and reviewer.
+    Lines are streamed straight from src to out, so neither the source nor the annotated
+    copy is ever held whole, and source bytes go through without a decode/encode round-trip.
     """
-    try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            original_lines = f.readlines()
-    except Exception as e:
-        print(f"Error reading file {filepath}: {e}")
-        return None
-
-    # Build a mapping: line number -> list of annotation strings.
+    # Build a mapping: line number -> encoded annotation lines, joined once.
     annotations = {}
-    for comment in comments:
-        line = comment.get("line")
-        if line is None:
-            continue
-        ps = comment.get("patchSet", comment.get("patch_set", "Unknown"))
-        reviewer = comment.get("reviewer", {}).get("name", "Unknown")
-        msg = comment.get("message", "")
-        annotation = f"[Patchset {ps}] {reviewer}: {msg}"
-        annotations.setdefault(line, []).append(annotation)
+    for line, comments in comments_by_line.items():
+        # Prepend an annotation marker; these lines are only for display.
+        annotations[line] = b"".join(
+            f"  >>> [Patchset {ps}] {reviewer}: {msg}\n".encode("utf-8")
+            for _, ps, reviewer, msg in comments
+        )
 
-    annotated_lines = []
-    for i, line in enumerate(original_lines, start=1):
-        annotated_lines.append(line.rstrip("\n"))
-        if i in annotations:
-            for ann in annotations[i]:
-                # Prepend an annotation marker; these lines are only for display.
-                annotated_lines.append("  >>> " + ann)
-    return "\n".join(annotated_lines) + "\n"
+    w = out.write
+    readline = src.readline
+    # Annotated lines are visited in order: source lines are read only up to each one,
+    # and everything after the last is copied in one piece. Annotations take the line
+    # ending of the line they follow, so CRLF files stay CRLF (same loop as grawl.py).
+    i = 0
+    eol = b"\n"
+    for n, ln in sorted((int(ln), ln) for ln in annotations if isinstance(ln, (int, float)) and ln > 0 and ln % 1 == 0):
+        while i < n:
+            line = readline()
+            if not line:
+                return
+            i += 1
+            w(line)
+            if not line.endswith(b"\n"):
+                w(eol)
+        if line.endswith(b"\n"):
+            eol = b"\r\n" if line.endswith(b"\r\n") else b"\n"
+        block = annotations[ln]
+        w(block if eol == b"\n" else block.replace(b"\n", eol))
+    rest = src.read()
+    if rest:
+        w(rest)
+        if not rest.endswith(b"\n"):
+            w(eol)
 
-def show_diff_in_vscode(filepath, annotated_content):
+def show_diff_in_vscode(filepath, comments_by_line, temp_name=None, reuse_window=False):
     """
-    Write the annotated content to a temporary file and open a VS Code diff view
+    Write an annotated copy of filepath to a temporary file and open a VS Code diff view
     between the original file and the temporary annotated version.
+    temp_name overrides the temporary file's base name (default: the file's basename).
+    With reuse_window, the diff opens as a tab in the already-running VS Code window.
+    The diff is launched without waiting; the process handle is returned (None on failure,
+    including when the file is missing or unreadable).
     """
     temp_dir = os.path.join(tempfile.gettempdir(), "gerrit_comments")
     os.makedirs(temp_dir, exist_ok=True)
-    temp_file = os.path.join(temp_dir, os.path.basename(filepath) + ".annotated")
+    temp_file = os.path.join(temp_dir, (temp_name or os.path.basename(filepath)) + ".annotated")
     try:
-        with open(temp_file, "w", encoding="utf-8") as f:
-            f.write(annotated_content)
+        src = open(filepath, "rb")
+    except FileNotFoundError:
+        print(f"File not found locally: {filepath}")
+        return
     except Exception as e:
-        print(f"Error writing temporary file for {filepath}: {e}")
+        print(f"Error reading file {filepath}: {e}")
         return
+    with src:
+        try:
+            with open(temp_file, "wb") as f:
+                annotate_file_with_all_comments(src, f, comments_by_line)
+        except Exception as e:
+            print(f"Error writing temporary file for {filepath}: {e}")
+            return
 
     try:
-        subprocess.run(["code", "--diff", filepath, temp_file])
+        cmd = ["code", "--reuse-window"] if reuse_window else ["code"]
+        return subprocess.Popen(
+            cmd + ["--diff", filepath, temp_file],
+            # stderr kept so a failing `code` launcher still reports its error.
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+        )
     except Exception as e:
         print(f"Failed to open VS Code diff for {filepath}: {e}")
 
-def display_all_file_diffs(change_info):
+def display_all_file_diffs(view, reuse_window=False):
     """
     For every file that has inline comments (across all patch sets), if the file exists
     locally, generate an annotated copy with all comments and open VS Code diff view.
-    If a file does not exist, note it.
+    If a file does not exist, note it. Files are read and annotated in parallel.
+    Takes the view from build_view and uses its per-line comment grouping.
     """
-    comments = change_info.get("comments", {})
-    for file_path, comm_list in comments.items():
-        if not os.path.exists(file_path):
-            print(f"File not found locally: {file_path}")
-            continue
-        annotated = annotate_file_with_all_comments(file_path, comm_list)
-        if annotated is None:
-            continue
-        show_diff_in_vscode(file_path, annotated)
+    comments = view["lines"]
+    if not comments:
+        return
+    # Index prefix only for repeated basenames.
+    basenames = Counter(os.path.basename(p) for p in comments)
+
+    def diff_one(job):
+        index, (file_path, by_line) = job
+        base = os.path.basename(file_path)
+        temp_name = f"{index}_{base}" if basenames[base] > 1 else base
+        return show_diff_in_vscode(file_path, by_line, temp_name, reuse_window)
+
+    with ThreadPoolExecutor(max_workers=min(32, len(comments))) as ex:
+        procs = [p for p in ex.map(diff_one, enumerate(comments.items())) if p is not None]
+    # All launches are in flight; reap them once rather than blocking per file.
+    for proc in procs:
+        proc.wait()
 
 # ----------------------------
 # Main Function
@@ -287,6 +388,11 @@ def main():
         action="store_true",
         help="Open inline diff views in VS Code (using built-in diff)"
     )
+    parser.add_argument(
+        "--reuse-window",
+        action="store_true",
+        help="Open all diff views as tabs in the running VS Code window"
+    )
     # SSH connection overrides
     parser.add_argument("--ssh-user", help="SSH user for Gerrit")
     parser.add_argument("--ssh-host", help="SSH host for Gerrit")
@@ -300,8 +406,8 @@ def main():
             print("Config file not found:", args.config)
             sys.exit(1)
         try:
-            with open(args.config, "r", encoding="utf-8") as f:
-                config = json.load(f)
+            with open(args.config, "rb") as f:
+                config = json_loads(f.read())
         except Exception as e:
             print("Error loading config:", e)
             sys.exit(1)
@@ -318,6 +424,9 @@ def main():
     # Ensure required SSH parameters.
     for param in ["ssh_user", "ssh_host"]:
         if param not in gerrit_config:
+            if not sys.stdin.isatty():
+                print(f"Missing Gerrit {param.replace('_', ' ')}; pass --{param.replace('_', '-')} or set it in --config.")
+                sys.exit(1)
             val = input(f"Enter Gerrit {param.replace('_', ' ')}: ").strip()
             gerrit_config[param] = val
 
@@ -328,8 +437,8 @@ def main():
         identifier_value = commit_hash
     else:
         # Default is "change". Extract Change-Id from commit message.
-        commit_hash = args.commit if args.commit else get_current_commit()
-        commit_msg = get_commit_message(commit_hash)
+        # git log resolves HEAD itself, so the message takes one git call with no rev-parse first.
+        commit_msg = get_commit_message(args.commit if args.commit else "HEAD")
         change_id = extract_change_id(commit_msg)
         if not change_id:
             print("No Change-Id found in commit message. Cannot map to a Gerrit change.")
@@ -345,21 +454,26 @@ def main():
     print(f"Found Gerrit Change {change_number}: {subject}")
 
     # Save output files (all patch sets, messages, inline comments, etc.)
+    # The view (sorted patch sets, grouped comments) is only built once markdown, text or
+    # --vscode needs it; a json-only run serializes change_info as it is.
+    view = None
     for fmt in args.output_format:
         if fmt == "json":
             output = format_output_json(change_info)
             ext = "json"
         elif fmt == "markdown":
-            output = format_output_markdown(change_info)
+            view = view or build_view(change_info)
+            output = format_output_markdown(view).encode("utf-8")
             ext = "md"
         elif fmt == "text":
-            output = format_output_text(change_info)
+            view = view or build_view(change_info)
+            output = format_output_text(view).encode("utf-8")
             ext = "txt"
         else:
             continue
         filename = f"comments_{change_number}.{ext}"
         try:
-            with open(filename, "w", encoding="utf-8") as f:
+            with open(filename, "wb") as f:
                 f.write(output)
             print(f"Output saved to {filename}")
         except Exception as e:
@@ -368,7 +482,7 @@ def main():
     # Use VS Code diff view to show inline comments without modifying files.
     if args.vscode:
         print("Launching VS Code diff views for files with inline comments...")
-        display_all_file_diffs(change_info)
+        display_all_file_diffs(view or build_view(change_info), args.reuse_window)
 
 if __name__ == "__main__":
     main()